@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# Author: zhangjoto
+# E-Mail: zhangjoto@gmail.com
+#
+# Create Date: 2016-08-02
+#
+
+"""task采样数据的本地预聚合。
+
+采样频率较高而Server端只需要汇总数据时，task每次的返回值先交给Aggregator累
+积，只在每个聚合窗口结束时发出一个汇总报文，从而将采样频率与发送频率解耦。
+"""
+
+import bisect
+import numbers
+
+from . import util
+
+
+def numeric_values(value):
+    """从task返回值中取出全部数值。
+
+    返回值可以是单个数值，也可以是(嵌套的)list/tuple，其中的非数值元素被忽略。
+    """
+    # bool是int的子类，但不应参与数值统计
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [j for i in value for j in numeric_values(i)]
+    return []
+
+
+class Aggregator:
+    """单个task的聚合状态，只保存计数、极值、累加值、最新值及固定分桶直方图。
+
+    buckets为直方图各桶的上界（含），数值大于最后一个上界时计入溢出桶，因此
+    直方图长度比buckets多1。
+    """
+    def __init__(self, buckets=None):
+        self.buckets = sorted(buckets) if buckets else []
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.errors = 0
+        self.num = 0
+        self.min = None
+        self.max = None
+        self.sum = 0
+        self.last = None
+        self.hist = [0] * (len(self.buckets) + 1) if self.buckets else None
+        self.start = None
+
+    def add(self, value):
+        """累积一次task返回值。"""
+        if self.start is None:
+            self.start = util.timestamp()
+        self.count += 1
+        # task异常时由task_catch_except返回{'error': ...}
+        if isinstance(value, dict) and 'error' in value:
+            self.errors += 1
+            return
+        self.last = value
+        for val in numeric_values(value):
+            self.num += 1
+            self.sum += val
+            if self.min is None or val < self.min:
+                self.min = val
+            if self.max is None or val > self.max:
+                self.max = val
+            if self.hist is not None:
+                self.hist[bisect.bisect_left(self.buckets, val)] += 1
+
+    def flush(self):
+        """返回当前窗口的汇总数据并清空状态，窗口内没有采样时返回None。"""
+        if self.count == 0:
+            return None
+        summary = dict(count=self.count, errors=self.errors, num=self.num,
+                       min=self.min, max=self.max, sum=self.sum,
+                       last=self.last, start=self.start)
+        if self.hist is not None:
+            summary['buckets'] = self.buckets
+            summary['hist'] = self.hist
+        self.reset()
+        return summary
@@ -18,11 +18,18 @@
 import collections
 import json
 import logging
+import math
 import os
+import random
 import sched
 import socket
+import threading
 import time
 
+from . import aggregate
+from . import crontab
+from . import outbound
+from . import profiling
 from . import util
 
 
@@ -101,6 +108,7 @@ class BaseAgent(object):
     - connection_init()
     - connection_close()
     - send_infor(pack)
+    - send_close()
 
     可以被覆盖的属性：
 
@@ -119,10 +127,13 @@ class BaseAgent(object):
         self.fname = config_file
         self.load_conf(self.fname)
         self.ext = ext_module
+        self.logger = logging.getLogger(__name__)
         self.connection_init()
         self.timer = timer
         self.scher = sched.scheduler(time.time, self.delayfunc)
-        self.logger = logging.getLogger(__name__)
+        self.aggs = {}
+        self.triggers = {}
+        self.profiler = None
 
     def load_conf(self, fname):
         """读取配置文件，配置信息为OrderDict对象。"""
@@ -130,18 +141,78 @@ class BaseAgent(object):
             # 使用OrderedDict存取，是为了方便配置文件的管理、核对
             self.conf = json.load(f, object_pairs_hook=collections.OrderedDict)
 
-    def one_task_reg(self, task):
+    def one_task_reg(self, task, nominal=None):
+        """执行task并登记下一次执行。
+
+        interval task按nominal（本次的名义执行时刻，缺省为当前时间）加
+        trigInter得到下一次的名义时刻，再叠加[0, trigJitter)秒的随机抖动；
+        抖动不会累积，平均执行频率不变。调度落后（task耗时过长、主机挂起、
+        系统时间跳变等）时跳过已错过的时刻，不补执行。
+        """
         if task['monTrigger'] == 'interval':
-            self.scher.enter(task['trigInter'], task['execPrio'],
-                             self.one_task_reg, (task,))
+            now = time.time()
+            if nominal is None:
+                nominal = now
+            nominal += task['trigInter']
+            if nominal < now:
+                nominal += math.ceil(
+                    (now - nominal) / task['trigInter']) * task['trigInter']
+            nexttime = nominal
+            if task.get('trigJitter'):
+                nexttime += random.uniform(0, task['trigJitter'])
+            self.scher.enterabs(nexttime, task['execPrio'],
+                                self.one_task_reg, (task, nominal))
         else:
-            nexttime = util.attime(task['trigTime'])
+            nexttime = self.calendar(task).next_fire(time.time())
             self.scher.enterabs(nexttime, task['execPrio'],
                                 self.one_task_reg, (task,))
         return self.task_wrapper(task)
 
+    def calendar(self, task):
+        """返回定时task的日历触发器，触发时刻表按monType缓存。"""
+        trigger = self.triggers.get(task['monType'])
+        if trigger is None:
+            trigger = crontab.CalendarTrigger(task['trigTime'],
+                                              task.get('trigZone'))
+            self.triggers[task['monType']] = trigger
+        return trigger
+
+    def phase_offset(self, task, period):
+        """按nodId及monType散列出的相位偏移，取值[0, period)。
+
+        同一配置启动的大量Agent据此在周期内均匀错开，且每次重启结果不变。
+        """
+        key = '{}/{}'.format(self.conf['nodId'], task['monType'])
+        return util.phase(key) * period
+
+    def agg_task_reg(self, task):
+        """为配置了aggWindow的task建立聚合状态，并按窗口定时发出汇总报文。
+
+        trigInter/trigTime仍然决定采样频率，aggWindow（秒）决定发送频率；
+        aggBuckets可选，为数值直方图各桶的上界。配置trigSpread时首次发送按
+        phase_offset错开。
+        """
+        self.aggs[task['monType']] = aggregate.Aggregator(
+            task.get('aggBuckets'))
+        delay = task['aggWindow']
+        if task.get('trigSpread'):
+            delay = self.phase_offset(task, delay)
+        self.scher.enter(delay, task['execPrio'], self.agg_flush, (task,))
+
+    def agg_flush(self, task):
+        """发出一个聚合窗口的汇总报文，窗口内没有采样时不发送。"""
+        self.scher.enter(task['aggWindow'], task['execPrio'],
+                         self.agg_flush, (task,))
+        summary = self.aggs[task['monType']].flush()
+        if summary is not None:
+            self.send_infor(self.pack_infor(task['monType'], [summary]))
+
     def all_task_reg(self):
-        """全部task注册到调度器。"""
+        """全部task注册到调度器。
+
+        interval task默认立即执行一次；配置trigSpread为true时，首次执行推迟
+        phase_offset秒，避免同时重启的大量Agent集中发送。
+        """
         # 使用闭包包装监控函数，目的是捕捉除键盘中断以外的所有异常，避免监控函
         # 数代码质量导致agent退出
         # 捕捉到异常后的处理机制需要与监控Server端约定
@@ -160,7 +231,15 @@ class BaseAgent(object):
 
         for task in self.conf['monItems']:
             task['execProg'] = task_catch_except(task)
-            self.one_task_reg(task)
+            if task.get('aggWindow'):
+                self.agg_task_reg(task)
+            if task['monTrigger'] == 'interval' and task.get('trigSpread'):
+                first = time.time() + self.phase_offset(task,
+                                                        task['trigInter'])
+                self.scher.enterabs(first, task['execPrio'],
+                                    self.one_task_reg, (task, first))
+            else:
+                self.one_task_reg(task)
 
     def pack_infor(self, *infor):
         """为task返回的数据补充公共报文数据。"""
@@ -174,10 +253,22 @@ class BaseAgent(object):
         header = len(pack).to_bytes(2, 'big')
         return header + pack
 
-    def task_wrapper(self, task):
-        """组合task执行及将数据发出的所有动作。"""
-        self.send_infor(self.pack_infor(task['monType'],
-                                        task['execProg'](task['execArgs'])))
+    def task_wrapper(self, task, on_demand=False):
+        """组合task执行及将数据发出的所有动作。
+
+        需要聚合的task只累积返回值，由agg_flush统一发出；on_demand为True时
+        （Server指令触发）不参与聚合，直接发出本次结果。
+        """
+        if self.profiler is not None and self.profiler.wanted(task['monType']):
+            infor = self.profiler.runcall(task['monType'], task['execProg'],
+                                          task['execArgs'])
+        else:
+            infor = task['execProg'](task['execArgs'])
+        agg = self.aggs.get(task['monType'])
+        if agg is not None and not on_demand:
+            agg.add(infor)
+        else:
+            self.send_infor(self.pack_infor(task['monType'], infor))
 
     def delayfunc(self, timeout):
         try:
@@ -194,18 +285,61 @@ class BaseAgent(object):
             # 配置文件更新逻辑，如何实现还未确定
             if ret_val == 'update':
                 pass
+            elif ret_val == 'profile':
+                self.profile_start(detail or {})
+                self.timer.response(is_ok=True)
             else:
                 mon_types = [i['monType'] for i in self.conf['monItems']]
                 if ret_val in mon_types:
                     task = self.conf['monItems'][mon_types.index(ret_val)]
                     self.scher.enterabs(time.time(), task['execPrio'],
-                                        self.task_wrapper, (task,))
+                                        self.task_wrapper, (task, True))
                     self.timer.response(is_ok=True)
                 else:
                     raise AssertionError('invalid cmd')
         except (AssertionError, OSError) as err:
             self.timer.response(is_ok=False, detail=str(err))
 
+    def profile_start(self, detail):
+        """开始限时采样，detail为Server指令中的参数：
+
+        - duration: 采样时长（秒），默认60；
+        - monTypes: 需要采样的monType列表，缺省时采样整个调度循环；
+        - top: 返回的统计条数，默认20。
+
+        采样结束后以monType为profile的报文发出结果。结果报文超过UDP报文的长
+        度限制，因此UDP方式不支持采样。
+        """
+        if isinstance(self, UDPMixIn):
+            raise AssertionError('profile is not supported over UDP')
+        if self.profiler is not None:
+            raise AssertionError('profiling is running')
+        if not isinstance(detail, dict):
+            raise AssertionError('invalid profile detail')
+        mon_types = detail.get('monTypes')
+        if mon_types is not None and (
+                not isinstance(mon_types, list)
+                or not all(isinstance(i, str) for i in mon_types)):
+            raise AssertionError('invalid monTypes')
+        if mon_types:
+            known = {i['monType'] for i in self.conf['monItems']}
+            if not known.issuperset(mon_types):
+                raise AssertionError('invalid monTypes')
+        profiler = profiling.Profiler(detail.get('duration', 60), mon_types,
+                                      detail.get('top', 20))
+        profiler.start()
+        self.profiler = profiler
+        self.scher.enter(profiler.duration, 0, self.profile_stop)
+
+    def profile_stop(self):
+        """结束采样并发出结果。"""
+        profiler, self.profiler = self.profiler, None
+        try:
+            self.send_infor(self.pack_infor('profile', [profiler.stop()]))
+        except Exception as err:
+            # 采样结果发送失败不能影响调度循环
+            self.logger.error('send profile error: %s', err)
+
     def run_forever(self):
         try:
             self.all_task_reg()
@@ -213,6 +347,7 @@ class BaseAgent(object):
         except KeyboardInterrupt:
             self.logger.info('catch KeyboardInterrupt, agent close.')
         finally:
+            self.send_close()
             self.connection_close()
 
     def send_infor(self, pack):
@@ -222,6 +357,13 @@ class BaseAgent(object):
         """
         pass
 
+    def send_close(self):
+        """关闭连接前停止发送。
+
+        应由QueuedSendMixIn等MixIn类覆盖。
+        """
+        pass
+
     def connection_init(self):
         """初始化与Server端的连接。
 
@@ -246,7 +388,7 @@ class ShortTCPMixIn(object):
         srvinfo = self.conf['srvInfo']
         try:
             sock.connect((srvinfo['srvAddr'], srvinfo['srvPort']))
-            sock.send(pack)
+            sock.sendall(pack)
             self.logger.debug('send pack success: %s', pack)
         except socket.error as err:
             self.logger.error(err)
@@ -278,7 +420,7 @@ class LongTCPMixIn(object):
         发送失败时会且仅会尝试一次重新建链。
         """
         try:
-            self.sock.send(pack)
+            self.sock.sendall(pack)
             self.logger.debug('send pack success: %s', pack)
         except socket.error as err:
             self.logger.error(err)
@@ -312,6 +454,68 @@ class UDPMixIn(object):
             self.connection_init()
 
 
+class QueuedSendMixIn(object):
+    """将报文放入有界队列，由独立线程发送的MixIn类。
+
+    须放在ShortTCPMixIn/LongTCPMixIn/UDPMixIn之前，srvInfo中的相关配置：
+
+    - sndQueueSize: 队列长度，默认1000；
+    - sndOverflow: 队列满时的策略，drop_oldest/drop_newest/spill，默认
+      drop_oldest；
+    - sndSpillFile: spill策略的落盘文件；
+    - sndByteRate/sndPackRate: 每秒发送的字节数/报文数上限，缺省不限速。
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        srvinfo = self.conf['srvInfo']
+        self.outq = outbound.OutboundQueue(
+            srvinfo.get('sndQueueSize', 1000),
+            srvinfo.get('sndOverflow', 'drop_oldest'),
+            srvinfo.get('sndSpillFile'))
+        self.buckets = []
+        if srvinfo.get('sndPackRate'):
+            self.buckets.append(
+                (outbound.TokenBucket(srvinfo['sndPackRate']), lambda p: 1))
+        if srvinfo.get('sndByteRate'):
+            self.buckets.append(
+                (outbound.TokenBucket(srvinfo['sndByteRate']), len))
+        self.sender = threading.Thread(target=self.sender_loop, daemon=True)
+        self.sender.start()
+
+    def send_infor(self, pack):
+        """报文入队后立即返回，不阻塞调度线程。"""
+        if not self.outq.put(pack):
+            self.logger.warning('outbound queue full, pack dropped')
+
+    def sender_loop(self):
+        while True:
+            pack = self.outq.get()
+            if pack is None:
+                if self.outq.closed:
+                    break
+                continue
+            for bucket, amount in self.buckets:
+                delay = bucket.consume(amount(pack))
+                while delay:
+                    time.sleep(delay)
+                    delay = bucket.consume(amount(pack))
+            try:
+                super().send_infor(pack)
+            except Exception as err:
+                # 发送线程不能因为单个报文出错而退出
+                self.logger.error('send pack error: %s', err)
+
+    def send_stats(self):
+        """返回队列深度及丢弃、落盘计数。"""
+        return self.outq.stats()
+
+    def send_close(self, timeout=3):
+        """关闭队列并等待发送线程发完剩余报文。"""
+        self.outq.close()
+        self.sender.join(timeout)
+        super().send_close()
+
+
 class AgentShortTCP(ShortTCPMixIn, BaseAgent):
     pass
 
@@ -322,3 +526,15 @@ class AgentLongTCP(LongTCPMixIn, BaseAgent):
 
 class AgentUDP(UDPMixIn, BaseAgent):
     pass
+
+
+class AgentQueuedShortTCP(QueuedSendMixIn, ShortTCPMixIn, BaseAgent):
+    pass
+
+
+class AgentQueuedLongTCP(QueuedSendMixIn, LongTCPMixIn, BaseAgent):
+    pass
+
+
+class AgentQueuedUDP(QueuedSendMixIn, UDPMixIn, BaseAgent):
+    pass
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#
+# Author: zhangjoto
+# E-Mail: zhangjoto@gmail.com
+#
+# Create Date: 2016-08-23
+#
+
+"""定时(非interval)task的日历触发器。
+
+trigTime支持两种写法：
+
+- [HH, MM, SS]: 每天的固定时刻，与旧版本兼容；
+- cron表达式字符串: "秒 分 时 日 月 周"，省略秒字段时为标准的5段格式，秒取0。
+  每段支持*、数值、a-b、*/n、a-b/n及逗号分隔的列表，周字段0和7都表示周日。
+  日与周字段同时受限（都不以*开头）时，满足其一即触发（与cron一致）。
+
+trigZone可指定时区名（如Asia/Shanghai），缺省为本地时区。
+
+触发时刻按表达式预先展开为升序的时间戳表，每次查找下一触发时刻只需二分查找，
+表用完后再从最后一个时刻继续展开。每次展开只计算所需的size个时刻，没有时区
+偏移变化的日期直接按当天零点加秒数得到时间戳。
+"""
+
+import bisect
+import datetime
+import heapq
+import itertools
+import zoneinfo
+
+
+# (最小值, 最大值)，依次为秒、分、时、日、月、周
+FIELD_RANGES = ((0, 59), (0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def parse_field(text, low, high):
+    """解析cron表达式的单个字段，返回取值的集合。"""
+    values = set()
+    for part in text.split(','):
+        rng, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if rng == '*':
+            start, end = low, high
+        elif '-' in rng:
+            start, end = map(int, rng.split('-'))
+        else:
+            start = end = int(rng)
+            if step > 1:
+                end = high
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError('invalid cron field: {}'.format(text))
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpr:
+    """解析后的cron表达式。"""
+    def __init__(self, expr):
+        if isinstance(expr, (list, tuple)):
+            hour, minute, sec = expr
+            expr = '{} {} {} * * *'.format(sec, minute, hour)
+        fields = expr.split()
+        if len(fields) == 5:
+            fields.insert(0, '0')
+        if len(fields) != 6:
+            raise ValueError('invalid cron expression: {}'.format(expr))
+        self.expr = expr
+        (self.secs, self.mins, self.hours, self.days, self.months,
+         weekdays) = [parse_field(text, *rng)
+                      for text, rng in zip(fields, FIELD_RANGES)]
+        self.weekdays = {i % 7 for i in weekdays}
+        # 与cron一致，以*开头（包括*/n）的日、周字段视为不受限
+        self.day_any = fields[3].startswith('*')
+        self.weekday_any = fields[5].startswith('*')
+        # 每天内的触发时刻，按时间先后排列
+        self.times = sorted(itertools.product(self.hours, self.mins,
+                                              self.secs))
+        # 同上，以当天的秒数表示
+        self.day_secs = [h * 3600 + m * 60 + s for h, m, s in self.times]
+
+    def match_date(self, date):
+        if date.month not in self.months:
+            return False
+        # cron中周日为0，date.weekday()中周一为0
+        day_ok = date.day in self.days
+        weekday_ok = (date.weekday() + 1) % 7 in self.weekdays
+        if self.day_any or self.weekday_any:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+
+class CalendarTrigger:
+    """按cron表达式预先展开的触发时刻表。
+
+    size为每次展开的时刻数，max_days为展开时最多向后查找的天数。
+    """
+    def __init__(self, expr, tz=None, size=256, max_days=366 * 8):
+        self.cron = CronExpr(expr)
+        self.tz = zoneinfo.ZoneInfo(tz) if tz else None
+        self.size = size
+        self.max_days = max_days
+        self.table = []
+
+    def fill(self, after):
+        """展开晚于时间戳after的至多size个触发时刻。"""
+        table = []
+        local = datetime.datetime.fromtimestamp(after, self.tz)
+        date = local.date()
+        after_secs = local.hour * 3600 + local.minute * 60 + local.second
+        for _ in range(self.max_days):
+            if self.cron.match_date(date):
+                self.fill_day(table, date, after, after_secs)
+                if len(table) >= self.size:
+                    break
+            date += datetime.timedelta(1)
+            after_secs = -1
+        if not table:
+            raise ValueError('cron expression never fires: {}'.format(
+                self.cron.expr))
+        self.table = table
+
+    def fill_day(self, table, date, after, after_secs):
+        """将date当天晚于after的触发时刻追加到table，至多追加到size个。
+
+        after_secs为after在当天的秒数，after早于当天时为-1。
+        """
+        def stamp(hour, minute, sec):
+            return datetime.datetime(date.year, date.month, date.day, hour,
+                                     minute, sec, tzinfo=self.tz).timestamp()
+
+        base = stamp(0, 0, 0)
+        shift = stamp(23, 59, 59) - base - 86399
+        day_secs = self.cron.day_secs
+        if not shift:
+            # 当天没有时区偏移变化，时间戳随当天秒数单调递增
+            idx = bisect.bisect_right(day_secs, after_secs)
+            for secs in day_secs[idx:]:
+                ts = base + secs
+                if ts > after:
+                    table.append(ts)
+                    if len(table) >= self.size:
+                        return
+            return
+
+        # 夏令时切换日：跳过的时刻按跳变后的时刻触发，可能与当天其他时刻重合
+        # 或乱序；重复的时刻只触发第一次（fold=0）。跳变后的时刻先放入堆中，
+        # 直到后续正常时刻的时间戳超过它再输出。
+        idx = bisect.bisect_left(day_secs, after_secs - abs(shift))
+        pending = []
+        for (hour, minute, sec), secs in zip(self.cron.times[idx:],
+                                              day_secs[idx:]):
+            ts = stamp(hour, minute, sec)
+            wall = datetime.datetime.fromtimestamp(ts, self.tz)
+            if (wall.hour, wall.minute, wall.second) != (hour, minute, sec):
+                heapq.heappush(pending, ts)
+                continue
+            while pending and pending[0] <= ts:
+                self.append_once(table, heapq.heappop(pending), after)
+            self.append_once(table, ts, after)
+            if len(table) >= self.size:
+                return
+        while pending and len(table) < self.size:
+            self.append_once(table, heapq.heappop(pending), after)
+
+    @staticmethod
+    def append_once(table, ts, after):
+        if ts > after and (not table or ts > table[-1]):
+            table.append(ts)
+
+    def next_fire(self, now):
+        """返回晚于时间戳now的下一个触发时刻。"""
+        idx = bisect.bisect_right(self.table, now)
+        if idx == len(self.table):
+            self.fill(now)
+            idx = bisect.bisect_right(self.table, now)
+        return self.table[idx]
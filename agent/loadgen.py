@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+#
+# Author: zhangjoto
+# E-Mail: zhangjoto@gmail.com
+#
+# Create Date: 2016-08-16
+#
+
+"""在单个进程内模拟大量Agent的压测工具。
+
+每个虚拟Agent都是真实的Agent类实例（使用BaseAgent.pack_infor及各传输MixIn），
+拥有独立的nodId，由同一个调度循环按各自的trigInter把task提交到共享线程池执行，
+报文发往本进程内的接收端，最后统计实际速率、延时分位数及出错比例。
+
+延时从task的计划执行时刻算起，到报文发送完成为止，包含在线程池中排队的时间；
+调度滞后为提交到线程池的时刻与计划时刻之差。
+
+用法示例：
+
+    python -m agent.loadgen --agents 2000 --duration 60 --link long
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import heapq
+import json
+import logging
+import random
+import selectors
+import socket
+import threading
+import time
+
+from . import core
+
+
+LINK_MIXINS = {
+    'short': core.ShortTCPMixIn,
+    'long': core.LongTCPMixIn,
+    'udp': core.UDPMixIn,
+}
+
+
+DEFAULT_MIX = [
+    {
+        'execProg': 'payload',
+        'monType': '0011',
+        'monTrigger': 'interval',
+        'execArgs': {'rows': [1, 10], 'size': 32},
+        'execPrio': 5,
+        'trigInter': 1,
+    }
+]
+
+
+class PayloadExt:
+    """虚拟Agent的task模块，按execArgs给出的分布生成数据。
+
+    execArgs中rows为行数的取值范围（均匀分布），size为每行字符串长度。
+    """
+    def __init__(self, seed=None):
+        self.rand = random.Random(seed)
+
+    def payload(self, args):
+        low, high = args.get('rows', [1, 1])
+        row = 'x' * args.get('size', 16)
+        return [(row,)] * self.rand.randint(low, high)
+
+
+class CountLog:
+    """统计error调用次数的日志对象，其余级别转交给模块日志。"""
+    def __init__(self):
+        self.errors = 0
+        self.logger = logging.getLogger(__name__)
+
+    def error(self, *args):
+        self.errors += 1
+        self.logger.debug(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.logger, name)
+
+
+class VirtualAgentMixIn(object):
+    """虚拟Agent，配置直接取自dict，并记录每个报文从计划时刻到发送完成的延时。"""
+    def __init__(self, ext_module, conf):
+        self.lock = threading.Lock()
+        self.latencies = []
+        super().__init__(ext_module, conf)
+        self.logger = CountLog()
+
+    def load_conf(self, conf):
+        self.conf = conf
+
+    def timed_run(self, task, when):
+        """执行一次计划时刻为when的task。
+
+        传输MixIn捕捉socket错误后只记录日志，因此以error日志计数判断发送是否
+        成功，失败的发送不计入延时。
+        """
+        # 同一虚拟Agent的长连接不能被多个线程同时写
+        with self.lock:
+            errors = self.logger.errors
+            self.task_wrapper(task)
+            if self.logger.errors == errors:
+                self.latencies.append(time.time() - when)
+
+
+class LocalSink:
+    """本地接收端，单线程用selectors处理全部TCP连接及UDP报文。"""
+    def __init__(self, host=('127.0.0.1', 0)):
+        self.sel = selectors.DefaultSelector()
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind(host)
+        self.tcp.listen(1024)
+        self.tcp.setblocking(False)
+        self.address = self.tcp.getsockname()
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(self.address)
+        self.udp.setblocking(False)
+        self.sel.register(self.tcp, selectors.EVENT_READ, self.accept)
+        self.sel.register(self.udp, selectors.EVENT_READ, self.recv_udp)
+        self.packs = 0
+        self.bytes = 0
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def serve(self):
+        while self.running:
+            for key, _ in self.sel.select(0.1):
+                key.data(key.fileobj)
+
+    def accept(self, sock):
+        try:
+            conn, _ = sock.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        self.sel.register(conn, selectors.EVENT_READ,
+                          lambda c, buf=bytearray(): self.recv_tcp(c, buf))
+
+    def recv_tcp(self, conn, buf):
+        try:
+            data = conn.recv(65536)
+        except ConnectionError:
+            data = b''
+        if not data:
+            self.sel.unregister(conn)
+            conn.close()
+            return
+        buf.extend(data)
+        # 按2字节长度头拆出完整报文
+        while len(buf) >= 2:
+            end = 2 + int.from_bytes(buf[:2], 'big')
+            if len(buf) < end:
+                break
+            self.count(end)
+            del buf[:end]
+
+    def recv_udp(self, sock):
+        try:
+            data = sock.recv(65536)
+        except BlockingIOError:
+            return
+        self.count(len(data))
+
+    def count(self, size):
+        with self.cond:
+            self.packs += 1
+            self.bytes += size
+            self.cond.notify_all()
+
+    def wait(self, packs, timeout):
+        """等待收到的报文数达到packs，超时返回False。"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.packs >= packs, timeout)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        for key in list(self.sel.get_map().values()):
+            key.fileobj.close()
+        self.sel.close()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    idx = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[idx]
+
+
+def percentiles_ms(sorted_values):
+    return collections.OrderedDict(
+        (name, round(percentile(sorted_values, pct) * 1000, 3))
+        for name, pct in (('p50', 50), ('p90', 90), ('p99', 99),
+                          ('max', 100)))
+
+
+class LoadGenerator:
+    """创建num个虚拟Agent并在duration秒内按task组合驱动它们。
+
+    drain_timeout为结束后等待接收端收齐报文的最长秒数。
+    """
+    def __init__(self, num, link='long', mix=None, workers=32, seed=None,
+                 host=('127.0.0.1', 0), drain_timeout=5):
+        self.drain_timeout = drain_timeout
+        self.rand = random.Random(seed)
+        self.sink = LocalSink(host).start()
+        self.mix = mix or DEFAULT_MIX
+        self.workers = workers
+        agtcls = type('VirtualAgent', (VirtualAgentMixIn, LINK_MIXINS[link],
+                                       core.BaseAgent), {})
+        self.agents = []
+        for i in range(num):
+            conf = collections.OrderedDict(
+                nodId=str(100000 + i),
+                srvInfo={'srvAddr': self.sink.address[0],
+                         'srvPort': self.sink.address[1]},
+                monItems=[dict(task) for task in self.mix])
+            self.agents.append(agtcls(PayloadExt(self.rand.random()), conf))
+        for agt in self.agents:
+            for task in agt.conf['monItems']:
+                task['execProg'] = getattr(agt.ext, task['execProg'])
+
+    def run(self, duration):
+        """运行duration秒并返回统计结果。"""
+        start = time.time()
+        # 各虚拟Agent在第一个周期内随机错开启动时间
+        heap = [(start + self.rand.uniform(0, task['trigInter']), i, j)
+                for i, agt in enumerate(self.agents)
+                for j, task in enumerate(agt.conf['monItems'])]
+        heapq.heapify(heap)
+        failures = 0
+        lags = []
+        pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        futures = []
+        try:
+            while heap and heap[0][0] < start + duration:
+                when, i, j = heapq.heappop(heap)
+                delay = when - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                agt = self.agents[i]
+                task = agt.conf['monItems'][j]
+                lags.append(time.time() - when)
+                futures.append(pool.submit(agt.timed_run, task, when))
+                heapq.heappush(heap, (when + task['trigInter'], i, j))
+        finally:
+            pool.shutdown(wait=True)
+        elapsed = time.time() - start
+        for fut in futures:
+            if fut.exception() is not None:
+                failures += 1
+        # 等待接收端处理完已成功发出的报文
+        errors = failures + sum(agt.logger.errors for agt in self.agents)
+        self.sink.wait(len(futures) - errors, self.drain_timeout)
+        return self.report(elapsed, len(futures), errors, lags)
+
+    def report(self, elapsed, submitted, errors, lags):
+        latencies = sorted(i for agt in self.agents for i in agt.latencies)
+        return collections.OrderedDict(
+            agents=len(self.agents),
+            elapsed=round(elapsed, 3),
+            submitted=submitted,
+            sent_rate=round(len(latencies) / elapsed, 1),
+            recv_packs=self.sink.packs,
+            recv_rate=round(self.sink.packs / elapsed, 1),
+            recv_bytes=self.sink.bytes,
+            errors=errors,
+            error_rate=round(errors / submitted, 4) if submitted else 0,
+            latency_ms=percentiles_ms(latencies),
+            sched_lag_ms=percentiles_ms(sorted(lags)))
+
+    def close(self):
+        for agt in self.agents:
+            agt.connection_close()
+        self.sink.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--agents', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--link', choices=sorted(LINK_MIXINS), default='long')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--mix', help='JSON file containing a monItems list')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    mix = None
+    if args.mix:
+        with open(args.mix) as f:
+            mix = json.load(f)
+    gen = LoadGenerator(args.agents, args.link, mix, args.workers, args.seed)
+    try:
+        print(json.dumps(gen.run(args.duration), indent=4))
+    finally:
+        gen.close()
+
+
+if __name__ == '__main__':
+    main()
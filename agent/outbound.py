@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+#
+# Author: zhangjoto
+# E-Mail: zhangjoto@gmail.com
+#
+# Create Date: 2016-08-09
+#
+
+"""task输出与传输层之间的发送队列及限速。
+
+task产生的报文先进入有界队列，由独立的发送线程按令牌桶限速后发出，Server端
+变慢时不会阻塞调度线程；队列满时按配置的策略丢弃或落盘。
+"""
+
+import collections
+import os
+import threading
+import time
+
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'spill')
+
+
+class TokenBucket:
+    """令牌桶，rate为每秒补充的令牌数，burst为桶容量（默认等于rate）。"""
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.stamp = clock()
+
+    def consume(self, amount=1):
+        """尝试取出amount个令牌，成功返回0，否则返回还需等待的秒数。
+
+        amount超过桶容量时只要求桶满，令牌数允许变为负值，以免大报文永远发不出。
+        """
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        need = min(amount, self.capacity)
+        if self.tokens >= need:
+            self.tokens -= amount
+            return 0
+        return (need - self.tokens) / self.rate
+
+
+class OutboundQueue:
+    """有界的线程安全报文队列。
+
+    队列满时的处理策略：
+
+    - drop_oldest: 丢弃最早的报文；
+    - drop_newest: 丢弃新报文；
+    - spill: 新报文追加写入spill_file，队列取空后再读回；文件中还有未读回
+      的报文时，新报文也写入文件，以保证先进先出。
+    """
+    def __init__(self, maxsize, overflow='drop_oldest', spill_file=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('invalid overflow policy: {}'.format(overflow))
+        if overflow == 'spill' and not spill_file:
+            raise ValueError('spill policy requires a spill file')
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.spill_file = spill_file and os.path.expandvars(spill_file)
+        self.que = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.spilled = 0
+        self.spill_pending = 0
+        # 落盘文件中下一个未读回报文的位置
+        self.spill_offset = 0
+        # 上次退出时未发出的落盘报文，只有spill策略才读回
+        if self.overflow == 'spill' and os.path.exists(self.spill_file):
+            with open(self.spill_file, 'rb') as f:
+                buf = f.read()
+            pos = 0
+            while pos + 2 <= len(buf):
+                end = pos + 2 + int.from_bytes(buf[pos:pos + 2], 'big')
+                if end > len(buf):
+                    break
+                pos = end
+                self.spill_pending += 1
+            # 写入中途退出会留下不完整的末尾报文，发出会打乱Server端的拆包
+            if pos < len(buf):
+                with open(self.spill_file, 'r+b') as f:
+                    f.truncate(pos)
+
+    def put(self, pack):
+        """放入报文，报文被丢弃时返回False。"""
+        with self.cond:
+            if self.overflow == 'spill' and (
+                    self.spill_pending or len(self.que) >= self.maxsize):
+                with open(self.spill_file, 'ab') as f:
+                    f.write(pack)
+                self.spilled += 1
+                self.spill_pending += 1
+                self.cond.notify()
+                return True
+            if len(self.que) >= self.maxsize:
+                if self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                else:
+                    self.que.popleft()
+                    self.dropped += 1
+            self.que.append(pack)
+            self.cond.notify()
+            return True
+
+    def get(self, timeout=None):
+        """取出一个报文，超时或队列已关闭且为空时返回None。"""
+        with self.cond:
+            if not self.que and self.spill_pending:
+                self.load_spill()
+            if not self.que and not self.closed:
+                self.cond.wait(timeout)
+                if not self.que and self.spill_pending:
+                    self.load_spill()
+            if not self.que:
+                return None
+            return self.que.popleft()
+
+    def load_spill(self):
+        """从落盘文件的spill_offset处读回至多maxsize个报文。
+
+        报文格式与pack_infor一致，即2字节长度头加报文体；文件中的报文全部读
+        回后清空文件。
+        """
+        with open(self.spill_file, 'rb') as f:
+            f.seek(self.spill_offset)
+            while self.spill_pending and len(self.que) < self.maxsize:
+                header = f.read(2)
+                self.que.append(
+                    header + f.read(int.from_bytes(header, 'big')))
+                self.spill_pending -= 1
+            self.spill_offset = f.tell()
+        if not self.spill_pending:
+            open(self.spill_file, 'wb').close()
+            self.spill_offset = 0
+
+    def close(self):
+        """关闭队列，唤醒等待中的get。"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return dict(depth=len(self.que), dropped=self.dropped,
+                        spilled=self.spilled, spill_pending=self.spill_pending)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# Author: zhangjoto
+# E-Mail: zhangjoto@gmail.com
+#
+# Create Date: 2016-09-06
+#
+
+"""按Server指令对Agent进行限时的CPU及内存分配采样。
+
+采样期间使用cProfile统计函数耗时、tracemalloc统计内存分配，结束后汇总出前N
+项结果。可以只采样指定monType的task，也可以采样整个调度循环。
+"""
+
+import cProfile
+import pstats
+import tracemalloc
+
+
+# 限制采样时长及结果条数，避免开销及报文过大
+MAX_DURATION = 600
+MAX_TOP = 50
+
+
+class Profiler:
+    """一次限时采样。
+
+    mon_types为None时采样整个调度循环（须在调度线程中调用start/stop），否则只
+    采样经由runcall执行的指定task。
+    """
+    def __init__(self, duration=60, mon_types=None, top=20):
+        # bool是int的子类，需要单独排除
+        if (not isinstance(duration, (int, float))
+                or isinstance(duration, bool)
+                or not 0 < duration <= MAX_DURATION):
+            raise AssertionError('invalid profile duration')
+        if (not isinstance(top, int) or isinstance(top, bool)
+                or not 0 < top <= MAX_TOP):
+            raise AssertionError('invalid profile top')
+        self.duration = duration
+        self.mon_types = set(mon_types) if mon_types else None
+        self.top = top
+        self.prof = cProfile.Profile()
+        self.calls = {}
+        self.peaks = {}
+
+    def start(self):
+        # 同一时间只能有一个cProfile/profile处于启用状态
+        try:
+            self.prof.enable()
+        except ValueError as err:
+            raise AssertionError('profiler unavailable: {}'.format(err))
+        if self.mon_types is not None:
+            self.prof.disable()
+        # 已有其他代码在跟踪内存分配时，结束后不能将其关闭
+        self.own_trace = not tracemalloc.is_tracing()
+        if self.own_trace:
+            tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+
+    def wanted(self, mon_type):
+        return self.mon_types is not None and mon_type in self.mon_types
+
+    def runcall(self, mon_type, func, *args):
+        """采样执行一次task，同时记录该task的内存峰值。
+
+        期间有其他profiler被启用时不做CPU采样，直接执行task。
+        """
+        self.calls[mon_type] = self.calls.get(mon_type, 0) + 1
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        try:
+            try:
+                self.prof.enable()
+            except ValueError:
+                return func(*args)
+            try:
+                return func(*args)
+            finally:
+                self.prof.disable()
+        finally:
+            peak = tracemalloc.get_traced_memory()[1] - base
+            self.peaks[mon_type] = max(self.peaks.get(mon_type, 0), peak)
+
+    def stop(self):
+        """结束采样，返回汇总结果。"""
+        if self.mon_types is None:
+            self.prof.disable()
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if self.own_trace:
+            tracemalloc.stop()
+
+        stats = pstats.Stats(self.prof).sort_stats('cumulative')
+        cpu = []
+        for func in stats.fcn_list[:self.top]:
+            _, ncalls, tottime, cumtime, _ = stats.stats[func]
+            cpu.append(dict(func='{}:{}({})'.format(*func), calls=ncalls,
+                            tottime=round(tottime, 6),
+                            cumtime=round(cumtime, 6)))
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, __file__))
+        alloc = [dict(where=str(stat.traceback[0]), size_diff=stat.size_diff,
+                      count_diff=stat.count_diff)
+                 for stat in snapshot.filter_traces(ignore).compare_to(
+                     self.snapshot.filter_traces(ignore), 'lineno')[:self.top]]
+        return dict(duration=self.duration,
+                    monTypes=sorted(self.mon_types or []),
+                    calls=self.calls, peak=peak, taskPeaks=self.peaks,
+                    cpu=cpu, alloc=alloc)
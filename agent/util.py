@@ -7,17 +7,14 @@
 #
 
 import datetime
-
-
-def attime(timetuple):
-    """根据传入的时刻值(HHMMSS)计算下一符合条件的时间。"""
-    hour, minute, sec = timetuple
-    curr = datetime.datetime.now()
-    at_time = curr.replace(hour=hour, minute=minute, second=sec)
-    if curr > at_time:
-        at_time += datetime.timedelta(1)
-    return at_time.timestamp()
+import hashlib
 
 
 def timestamp():
     return datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+
+
+def phase(key):
+    """将字符串稳定地散列到[0, 1)区间，不同进程、不同机器结果相同。"""
+    digest = hashlib.md5(key.encode()).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+#
+# Author: zhangjoto
+# E-Mail: zhangjoto@gmail.com
+#
+# Create Date: 2016-08-02
+#
+
+import unittest
+
+from agent import aggregate
+
+
+class TestAggregator(unittest.TestCase):
+    def test_numeric_values_flatten_and_skip_others(self):
+        self.assertEqual(aggregate.numeric_values([('a', 1), (2.5, True)]),
+                         [1, 2.5])
+        self.assertEqual(aggregate.numeric_values('abc'), [])
+
+    def test_flush_summary(self):
+        agg = aggregate.Aggregator([1, 10])
+        for val in (0.5, 3, 10, 20):
+            agg.add(val)
+        agg.add({'error': 'boom'})
+        summary = agg.flush()
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['num'], 4)
+        self.assertEqual((summary['min'], summary['max']), (0.5, 20))
+        self.assertEqual(summary['sum'], 33.5)
+        self.assertEqual(summary['last'], 20)
+        self.assertEqual(summary['hist'], [1, 2, 1])
+
+    def test_flush_reset_state(self):
+        agg = aggregate.Aggregator()
+        agg.add(1)
+        self.assertNotIn('hist', agg.flush())
+        self.assertIsNone(agg.flush())
+
+
+if __name__ == '__main__':
+    unittest.main()
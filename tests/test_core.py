@@ -130,6 +130,79 @@ class TestBaseAgent(unittest.TestCase):
                 inst.delayfunc(5)
                 mock.assert_called_with(is_ok=False, detail='invalid cmd')
 
+    def test_received_cmd_is_profile(self):
+        ext = unittest.mock.Mock()
+        ext.onecheck.return_value = [(1,)]
+        inst = self.make_agent(core.BaseAgent, ext)
+        inst.send_infor = unittest.mock.Mock()
+        task = inst.conf['monItems'][0]
+        task['execProg'] = ext.onecheck
+        detail = {'duration': 1, 'monTypes': ['0011'], 'top': 5}
+        with unittest.mock.patch.object(inst.timer, 'wait',
+                                        return_value=('profile', detail)):
+            with unittest.mock.patch.object(inst.timer, 'response') as mock:
+                inst.delayfunc(5)
+                mock.assert_called_with(is_ok=True)
+                inst.delayfunc(5)
+                mock.assert_called_with(is_ok=False,
+                                        detail='profiling is running')
+        inst.task_wrapper(task)
+        inst.scher.queue[0].action()
+        self.assertIsNone(inst.profiler)
+        pack = json.loads(inst.send_infor.call_args[0][0][2:].decode())
+        self.assertEqual(pack['type'], 'profile')
+        self.assertEqual(pack['detail'][0]['calls'], {'0011': 1})
+
+    def test_received_cmd_profile_with_malformed_detail(self):
+        inst = self.make_agent(core.BaseAgent, None)
+        cases = (({'monTypes': 5}, 'invalid monTypes'),
+                 ({'monTypes': [['x']]}, 'invalid monTypes'),
+                 ({'monTypes': ['9999']}, 'invalid monTypes'),
+                 ({'duration': True}, 'invalid profile duration'),
+                 ('5', 'invalid profile detail'))
+        for detail, msg in cases:
+            with unittest.mock.patch.object(inst.timer, 'wait',
+                                            return_value=('profile', detail)):
+                with unittest.mock.patch.object(inst.timer,
+                                                'response') as mock:
+                    inst.delayfunc(5)
+                    mock.assert_called_with(is_ok=False, detail=msg)
+            self.assertIsNone(inst.profiler)
+
+    def test_received_cmd_profile_rejected_over_udp(self):
+        inst = self.make_agent(core.AgentUDP, None)
+        self.addCleanup(inst.connection_close)
+        with unittest.mock.patch.object(inst.timer, 'wait',
+                                        return_value=('profile', {})):
+            with unittest.mock.patch.object(inst.timer, 'response') as mock:
+                inst.delayfunc(5)
+                mock.assert_called_with(
+                    is_ok=False, detail='profile is not supported over UDP')
+        self.assertIsNone(inst.profiler)
+
+    def test_received_cmd_profile_fail_when_profiler_busy(self):
+        inst = self.make_agent(core.BaseAgent, None)
+        with unittest.mock.patch.object(core.profiling.cProfile,
+                                        'Profile') as cls:
+            cls.return_value.enable.side_effect = ValueError('busy')
+            with unittest.mock.patch.object(inst.timer, 'wait',
+                                            return_value=('profile', {})):
+                with unittest.mock.patch.object(inst.timer,
+                                                'response') as mock:
+                    inst.delayfunc(5)
+                    mock.assert_called_with(
+                        is_ok=False, detail='profiler unavailable: busy')
+        self.assertIsNone(inst.profiler)
+
+    def test_profile_stop_catch_send_error(self):
+        inst = self.make_agent(core.BaseAgent, None)
+        inst.send_infor = unittest.mock.Mock(side_effect=AssertionError)
+        inst.logger = NullLog()
+        inst.profile_start({'duration': 1, 'monTypes': ['0011']})
+        inst.profile_stop()
+        self.assertIsNone(inst.profiler)
+        self.assertEqual(inst.logger.called, 1)
+
     def test_received_cmd_is_None(self):
         inst = self.make_agent(core.BaseAgent, None)
         inst.scher.enterabs = unittest.mock.Mock()
@@ -148,6 +221,95 @@ class TestBaseAgent(unittest.TestCase):
         self.assertEqual(ret_dict['count'], len(infor[1]))
         self.assertEqual(ret_dict['nodId'], self.init_conf['nodId'])
 
+    def test_task_wrapper_aggregate_until_flush(self):
+        ext = unittest.mock.Mock()
+        ext.onecheck.return_value = 2
+        inst = self.make_agent(core.BaseAgent, ext)
+        inst.send_infor = unittest.mock.Mock()
+        task = inst.conf['monItems'][0]
+        task['aggWindow'] = 60
+        # 注册时task会立即执行一次
+        inst.all_task_reg()
+        inst.task_wrapper(task)
+        inst.send_infor.assert_not_called()
+        inst.agg_flush(task)
+        pack = json.loads(inst.send_infor.call_args[0][0][2:].decode())
+        self.assertEqual(pack['detail'][0]['count'], 2)
+        self.assertEqual(pack['detail'][0]['sum'], 4)
+
+    def test_received_cmd_skip_aggregation(self):
+        ext = unittest.mock.Mock()
+        ext.onecheck.return_value = [(2,)]
+        inst = self.make_agent(core.BaseAgent, ext)
+        inst.send_infor = unittest.mock.Mock()
+        task = inst.conf['monItems'][0]
+        task['aggWindow'] = 60
+        inst.all_task_reg()
+        inst.scher = unittest.mock.Mock()
+        with unittest.mock.patch.object(inst.timer, 'wait',
+                                        return_value=('0011', None)):
+            inst.timer.response = unittest.mock.Mock()
+            inst.delayfunc(5)
+        _, _, action, args = inst.scher.enterabs.call_args[0]
+        action(*args)
+        pack = json.loads(inst.send_infor.call_args[0][0][2:].decode())
+        self.assertEqual(pack['detail'], [[2]])
+        self.assertEqual(inst.aggs['0011'].count, 1)
+
+    def test_one_task_reg_calendar_task(self):
+        inst = self.make_agent(core.BaseAgent, None)
+        inst.task_wrapper = unittest.mock.Mock()
+        task = inst.conf['monItems'][0]
+        task['monTrigger'] = 'time'
+        task['trigTime'] = '*/2 * * * * *'
+        inst.one_task_reg(task)
+        nexttime = inst.scher.queue[0].time
+        self.assertEqual(nexttime % 2, 0)
+        self.assertLessEqual(nexttime - time.time(), 2)
+
+    def test_all_task_reg_spread_first_run_by_nodid(self):
+        offsets = []
+        for nod_id in ('1001', '1002', '1001'):
+            inst = self.make_agent(core.BaseAgent, None)
+            inst.conf['nodId'] = nod_id
+            inst.task_wrapper = unittest.mock.Mock()
+            task = inst.conf['monItems'][0]
+            task['execProg'] = 'onecheck'
+            task['trigSpread'] = True
+            inst.ext = unittest.mock.Mock()
+            start = time.time()
+            inst.all_task_reg()
+            inst.task_wrapper.assert_not_called()
+            offset = inst.scher.queue[0].time - start
+            self.assertTrue(0 <= offset < task['trigInter'] + 0.01)
+            offsets.append(inst.phase_offset(task, task['trigInter']))
+        self.assertNotEqual(offsets[0], offsets[1])
+        self.assertEqual(offsets[0], offsets[2])
+
+    def test_one_task_reg_jitter_not_accumulate(self):
+        inst = self.make_agent(core.BaseAgent, None)
+        inst.task_wrapper = unittest.mock.Mock()
+        task = inst.conf['monItems'][0]
+        task['trigJitter'] = 1
+        nominal = time.time() + 100
+        inst.one_task_reg(task, nominal)
+        event = inst.scher.queue[0]
+        self.assertEqual(event.argument, (task, nominal + 3))
+        self.assertTrue(nominal + 3 <= event.time < nominal + 4)
+
+    def test_one_task_reg_skip_missed_runs(self):
+        inst = self.make_agent(core.BaseAgent, None)
+        inst.task_wrapper = unittest.mock.Mock()
+        task = inst.conf['monItems'][0]
+        nominal = time.time() - 3600
+        inst.one_task_reg(task, nominal)
+        self.assertEqual(len(inst.scher.queue), 1)
+        event = inst.scher.queue[0]
+        self.assertTrue(0 <= event.time - time.time() <= task['trigInter'])
+        # 跳过后仍保持在原来的名义时刻网格上
+        self.assertAlmostEqual((event.time - nominal) % task['trigInter'], 0,
+                               places=3)
+
     def test_all_task_reg_keyboard_interrupt_should_raise_out(self):
         ext = ExtTestMock(self.init_conf['monItems'][0], None)
         inst = self.make_agent(core.BaseAgent, ext)
@@ -177,6 +339,36 @@ class TestBaseAgent(unittest.TestCase):
         self.assertLess(abs(times[1] - times[0] - interval), 0.001)
 
 
+class TestQueuedSendMixIn(unittest.TestCase):
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp(text=True)
+        os.close(fd)
+        shutil.copyfile(os.path.join('example', 'agent.conf.json'), self.fname)
+
+    def tearDown(self):
+        os.remove(self.fname)
+
+    def test_send_infor_not_block_and_drain_on_close(self):
+        sent = []
+
+        class Transport:
+            def send_infor(self, pack):
+                time.sleep(0.01)
+                sent.append(pack)
+
+        class MyAgent(core.QueuedSendMixIn, Transport, core.BaseAgent):
+            pass
+
+        inst = MyAgent(None, self.fname)
+        start = time.time()
+        for i in range(5):
+            inst.send_infor(TEST_PACK)
+        self.assertLess(time.time() - start, 0.01)
+        inst.send_close()
+        self.assertEqual(sent, [TEST_PACK] * 5)
+        self.assertEqual(inst.send_stats()['depth'], 0)
+
+
 class TestShortTCPMixIn(unittest.TestCase):
     def setUp(self):
         self.mix_in = core.ShortTCPMixIn()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# Author: zhangjoto
+# E-Mail: zhangjoto@gmail.com
+#
+# Create Date: 2016-08-23
+#
+
+import datetime
+import unittest
+import zoneinfo
+
+from agent import crontab
+
+
+UTC = zoneinfo.ZoneInfo('UTC')
+
+
+def ts(*args, tz=UTC):
+    return datetime.datetime(*args, tzinfo=tz).timestamp()
+
+
+class TestCronExpr(unittest.TestCase):
+    def test_parse_field(self):
+        self.assertEqual(crontab.parse_field('*/20', 0, 59), {0, 20, 40})
+        self.assertEqual(crontab.parse_field('1-5/2,9', 0, 59), {1, 3, 5, 9})
+        self.assertEqual(crontab.parse_field('50/5', 0, 59), {50, 55})
+        with self.assertRaises(ValueError):
+            crontab.parse_field('60', 0, 59)
+
+    def test_legacy_time_tuple(self):
+        cron = crontab.CronExpr([8, 30, 15])
+        self.assertEqual(cron.times, [(8, 30, 15)])
+
+    def test_invalid_expression(self):
+        with self.assertRaises(ValueError):
+            crontab.CronExpr('* * *')
+
+
+class TestCalendarTrigger(unittest.TestCase):
+    def test_several_times_per_day(self):
+        trigger = crontab.CalendarTrigger('0 8,20 * * *', 'UTC')
+        now = ts(2016, 8, 23, 9)
+        self.assertEqual(trigger.next_fire(now), ts(2016, 8, 23, 20))
+        self.assertEqual(trigger.next_fire(ts(2016, 8, 23, 20)),
+                         ts(2016, 8, 24, 8))
+
+    def test_weekdays(self):
+        # 2016-08-27是周六
+        trigger = crontab.CalendarTrigger('0 9 * * 1-5', 'UTC')
+        self.assertEqual(trigger.next_fire(ts(2016, 8, 26, 10)),
+                         ts(2016, 8, 29, 9))
+
+    def test_day_or_weekday(self):
+        trigger = crontab.CalendarTrigger('0 0 1 * 0', 'UTC')
+        # 2016-08-28是周日，早于9月1日
+        self.assertEqual(trigger.next_fire(ts(2016, 8, 26)),
+                         ts(2016, 8, 28))
+
+    def test_day_step_star_is_unrestricted(self):
+        # */2的日字段按不受限处理，只在奇数日的周一触发
+        trigger = crontab.CalendarTrigger('0 0 */2 * 1', 'UTC')
+        self.assertEqual(trigger.next_fire(ts(2024, 1, 2)), ts(2024, 1, 15))
+
+    def test_dst_gap_and_overlap_fire_once(self):
+        tz = zoneinfo.ZoneInfo('America/New_York')
+        trigger = crontab.CalendarTrigger('30 1,2 * * *', 'America/New_York')
+        # 2016-03-13 02:30不存在，2016-11-06 01:30出现两次
+        spring = [trigger.next_fire(ts(2016, 3, 13, tz=tz))]
+        spring.append(trigger.next_fire(spring[-1]))
+        self.assertEqual(spring[1] - spring[0], 3600)
+        autumn = [trigger.next_fire(ts(2016, 11, 6, tz=tz))]
+        autumn.append(trigger.next_fire(autumn[-1]))
+        autumn.append(trigger.next_fire(autumn[-1]))
+        self.assertEqual(autumn[1] - autumn[0], 7200)
+        self.assertEqual(autumn[2], ts(2016, 11, 7, 1, 30, tz=tz))
+
+    def test_dst_gap_keep_order(self):
+        tz = zoneinfo.ZoneInfo('America/New_York')
+        trigger = crontab.CalendarTrigger('0 0,30 2,3 * * *',
+                                          'America/New_York')
+        trigger.fill(ts(2016, 3, 13, tz=tz))
+        # 02:00/02:30不存在，跳变后与03:00/03:30重合，只各触发一次
+        self.assertEqual(trigger.table[:3], [ts(2016, 3, 13, 3, tz=tz),
+                                             ts(2016, 3, 13, 3, 30, tz=tz),
+                                             ts(2016, 3, 14, 2, tz=tz)])
+
+    def test_fill_start_from_after_and_stop_at_size(self):
+        trigger = crontab.CalendarTrigger('* * * * * *', 'UTC', size=5)
+        trigger.fill(ts(2016, 8, 23, 12, 0, 30) + 0.5)
+        self.assertEqual(trigger.table, [ts(2016, 8, 23, 12, 0, 31 + i)
+                                         for i in range(5)])
+
+    def test_refill_when_table_used_up(self):
+        trigger = crontab.CalendarTrigger('*/10 * * * * *', 'UTC', size=4)
+        now = ts(2016, 8, 23)
+        fires = []
+        for _ in range(10):
+            now = trigger.next_fire(now)
+            fires.append(now)
+        self.assertEqual(len(trigger.table), 4)
+        self.assertEqual(fires, [ts(2016, 8, 23) + 10 * i
+                                 for i in range(1, 11)])
+
+    def test_never_fires(self):
+        trigger = crontab.CalendarTrigger('0 0 31 2 *', 'UTC')
+        with self.assertRaises(ValueError):
+            trigger.next_fire(ts(2016, 8, 23))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#
+# Author: zhangjoto
+# E-Mail: zhangjoto@gmail.com
+#
+# Create Date: 2016-08-16
+#
+
+import socket
+import unittest
+
+from agent import loadgen
+
+
+class TestLoadGenerator(unittest.TestCase):
+    def run_link(self, link):
+        mix = [dict(loadgen.DEFAULT_MIX[0], trigInter=0.1)]
+        gen = loadgen.LoadGenerator(5, link, mix, workers=4, seed=1)
+        try:
+            result = gen.run(0.5)
+        finally:
+            gen.close()
+        nod_ids = {agt.conf['nodId'] for agt in gen.agents}
+        self.assertEqual(len(nod_ids), 5)
+        self.assertEqual(result['submitted'], 25)
+        self.assertEqual(result['errors'], 0)
+        self.assertTrue(gen.sink.wait(result['submitted'], 5))
+        self.assertGreaterEqual(result['latency_ms']['max'],
+                                result['sched_lag_ms']['max'])
+
+    def test_failed_send_not_counted(self):
+        gen = loadgen.LoadGenerator(1, 'short', workers=1, seed=1)
+        # 指向一个未监听的端口，发送必然失败
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        gen.agents[0].conf['srvInfo']['srvPort'] = sock.getsockname()[1]
+        sock.close()
+        try:
+            result = gen.run(0.5)
+        finally:
+            gen.close()
+        self.assertEqual(result['errors'], result['submitted'])
+        self.assertEqual(result['sent_rate'], 0)
+        self.assertEqual(gen.agents[0].latencies, [])
+
+    def test_long_tcp(self):
+        self.run_link('long')
+
+    def test_udp(self):
+        self.run_link('udp')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#
+# Author: zhangjoto
+# E-Mail: zhangjoto@gmail.com
+#
+# Create Date: 2016-08-09
+#
+
+import os
+import tempfile
+import unittest
+
+from agent import outbound
+
+
+def make_pack(num):
+    body = str(num).encode()
+    return len(body).to_bytes(2, 'big') + body
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_consume_and_refill(self):
+        clock = FakeClock()
+        bucket = outbound.TokenBucket(10, clock=clock)
+        self.assertEqual(bucket.consume(10), 0)
+        self.assertAlmostEqual(bucket.consume(5), 0.5)
+        clock.now = 0.5
+        self.assertEqual(bucket.consume(5), 0)
+
+    def test_amount_larger_than_capacity(self):
+        bucket = outbound.TokenBucket(10, clock=FakeClock())
+        self.assertEqual(bucket.consume(30), 0)
+        self.assertGreater(bucket.consume(1), 0)
+
+
+class TestOutboundQueue(unittest.TestCase):
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            outbound.OutboundQueue(2, 'block')
+        with self.assertRaises(ValueError):
+            outbound.OutboundQueue(2, 'spill')
+
+    def test_drop_oldest(self):
+        que = outbound.OutboundQueue(2, 'drop_oldest')
+        for i in range(3):
+            self.assertTrue(que.put(make_pack(i)))
+        self.assertEqual(que.get(0), make_pack(1))
+        self.assertEqual(que.stats()['dropped'], 1)
+
+    def test_drop_newest(self):
+        que = outbound.OutboundQueue(2, 'drop_newest')
+        results = [que.put(make_pack(i)) for i in range(3)]
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(que.get(0), make_pack(0))
+        self.assertEqual(que.stats(), dict(depth=1, dropped=1, spilled=0,
+                                           spill_pending=0))
+
+    def test_spill_and_reload_in_order(self):
+        fd, fname = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, fname)
+        que = outbound.OutboundQueue(2, 'spill', fname)
+        for i in range(5):
+            que.put(make_pack(i))
+        self.assertEqual(que.stats()['spilled'], 3)
+        packs = [que.get(0) for i in range(6)]
+        self.assertEqual(packs, [make_pack(i) for i in range(5)] + [None])
+        self.assertEqual(os.path.getsize(fname), 0)
+
+    def test_spill_keep_order_when_put_after_get(self):
+        fd, fname = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, fname)
+        que = outbound.OutboundQueue(2, 'spill', fname)
+        for i in range(4):
+            que.put(make_pack(i))
+        packs = [que.get(0)]
+        que.put(make_pack(4))
+        packs.extend(que.get(0) for i in range(5))
+        self.assertEqual(packs, [make_pack(i) for i in range(5)] + [None])
+        self.assertEqual(que.stats()['spill_pending'], 0)
+
+    def test_leftover_spill_file_ignored_by_other_policies(self):
+        fd, fname = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, fname)
+        with open(fname, 'wb') as f:
+            f.write(make_pack(0) + make_pack(1))
+        for policy in ('drop_oldest', 'drop_newest'):
+            que = outbound.OutboundQueue(2, policy, fname)
+            self.assertTrue(que.put(make_pack(2)))
+            self.assertEqual(que.get(0), make_pack(2))
+            self.assertEqual(que.stats()['spill_pending'], 0)
+
+    def test_leftover_spill_file_truncate_partial_frame(self):
+        fd, fname = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, fname)
+        for tail in (b'\x00', b'\x00\x10{"cmd'):
+            with open(fname, 'wb') as f:
+                f.write(make_pack(0) + tail)
+            que = outbound.OutboundQueue(2, 'spill', fname)
+            self.assertEqual(que.stats()['spill_pending'], 1)
+            self.assertEqual(os.path.getsize(fname), len(make_pack(0)))
+            que.put(make_pack(1))
+            self.assertEqual([que.get(0) for i in range(3)],
+                             [make_pack(0), make_pack(1), None])
+
+    def test_get_return_none_when_closed(self):
+        que = outbound.OutboundQueue(2)
+        que.put(make_pack(0))
+        que.close()
+        self.assertEqual(que.get(), make_pack(0))
+        self.assertIsNone(que.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#
+# Author: zhangjoto
+# E-Mail: zhangjoto@gmail.com
+#
+# Create Date: 2016-09-06
+#
+
+import unittest
+import unittest.mock
+
+from agent import profiling
+
+
+def busy(num):
+    return [str(i) for i in range(num)]
+
+
+class TestProfiler(unittest.TestCase):
+    def test_invalid_args(self):
+        with self.assertRaises(AssertionError):
+            profiling.Profiler(duration=profiling.MAX_DURATION + 1)
+        with self.assertRaises(AssertionError):
+            profiling.Profiler(top=0)
+        with self.assertRaises(AssertionError):
+            profiling.Profiler(duration=True)
+
+    def test_start_fail_when_other_profiler_active(self):
+        # Python 3.12起，已有profiler启用时cProfile.enable抛出ValueError
+        with unittest.mock.patch.object(profiling.cProfile, 'Profile') as cls:
+            cls.return_value.enable.side_effect = ValueError
+            with self.assertRaises(AssertionError):
+                profiling.Profiler(1).start()
+
+    def test_runcall_selected_mon_type(self):
+        prof = profiling.Profiler(1, ['0011'], top=5)
+        self.assertTrue(prof.wanted('0011'))
+        self.assertFalse(prof.wanted('0012'))
+        prof.start()
+        self.assertEqual(len(prof.runcall('0011', busy, 1000)), 1000)
+        result = prof.stop()
+        self.assertEqual(result['calls'], {'0011': 1})
+        self.assertGreater(result['taskPeaks']['0011'], 0)
+        self.assertLessEqual(len(result['cpu']), 5)
+        self.assertTrue(any('busy' in i['func'] for i in result['cpu']))
+
+    def test_whole_loop(self):
+        prof = profiling.Profiler(1, top=3)
+        self.assertFalse(prof.wanted('0011'))
+        prof.start()
+        busy(1000)
+        result = prof.stop()
+        self.assertEqual(result['monTypes'], [])
+        self.assertTrue(any('busy' in i['func'] for i in result['cpu']))
+
+
+if __name__ == '__main__':
+    unittest.main()